@@ -1,11 +1,35 @@
 import streamlit as st
 import requests
-from PIL import Image, ImageOps, ImageFilter
-import pytesseract
+from PIL import Image
+import os
 import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 from io import BytesIO
+import numpy as np
 import pandas as pd
 
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+try:
+    # RE2's DFA engine scans without backtracking. compile()/search() match
+    # stdlib re for our purposes, but google-re2 exposes no flag constants,
+    # so any flags must be inline in the pattern.
+    import re2 as re_engine
+except ImportError:
+    re_engine = re
+
+try:
+    import tesserocr
+    HAVE_TESSEROCR = True
+except ImportError:
+    HAVE_TESSEROCR = False
+
 # --- Configuration ---
 IMAGE_URL = "https://srtaivedds.com/Images/Cameras/75B-002.0-CMS-CAM01-00001.jpg"
 
@@ -20,13 +44,49 @@ SIGN_LOCATIONS = [
     {"name": "Roswell Rd", "dist": 5.5},  # First price detected
     {"name": "I-285",      "dist": 11.0}  # Second price detected
 ]
+SIGN_NAMES = tuple(loc["name"] for loc in SIGN_LOCATIONS)
+SIGN_DISTS = np.array([loc["dist"] for loc in SIGN_LOCATIONS])
 
 # Hidden destination we want to calculate
 TERRELL_MILL_DIST = 9.0
 
+# Red-minus-green mean above this means the sign is lit red (CLOSED)
+CLOSED_RED_THRESHOLD = 30
+
+# Compiled once per process, not per rerun
+CLOSED_RE = re_engine.compile(r'(?i)CLOSED')
+
+def scan_prices(text):
+    # Tiny scanner specialized to the OCR alphabet ($, digits, dot): find a
+    # '.' followed by two digits, back up over the whole-dollar digits, and
+    # take at most one price per line — matching the one-price-per-row sign
+    # geometry, with no regex engine dispatch on strings this short.
+    prices = []
+    for line in text.splitlines():
+        for i, ch in enumerate(line):
+            if ch == '.' and i + 2 < len(line) and line[i + 1].isdigit() and line[i + 2].isdigit():
+                j = i
+                while j > 0 and line[j - 1].isdigit():
+                    j -= 1
+                prices.append(line[j:i + 3])
+                break
+    return prices
+
+@st.cache_resource(show_spinner=False)
+def get_cache_misses():
+    # Miss counters for the cached stages, held in a cache_resource dict so
+    # they survive Streamlit re-executing this module on every rerun (a
+    # plain module global would be re-zeroed each time). The decorated
+    # bodies only run on a miss, so these count real work done since
+    # process start; the sidebar panel renders before this run's calls, so
+    # it shows the totals as of the previous rerun.
+    return {"fetch": 0, "process_image": 0, "ocr": 0}
+
 st.set_page_config(page_title="GA Express Lane Rates", page_icon="🚗", layout="wide")
 st.title("🚗 NW Corridor Toll Rates (Barrett Pkwy)")
 
+CACHE_MISSES = get_cache_misses()
+
 # --- SIDEBAR ---
 st.sidebar.header("🔧 Calibration")
 threshold_val = st.sidebar.slider("Threshold", 0, 255, 160)
@@ -34,102 +94,269 @@ crop_val = st.sidebar.slider("Crop Left %", 0, 80, 55)
 resize_factor = st.sidebar.selectbox("Resize Factor", [1, 2, 3], index=2)
 invert_img = st.sidebar.checkbox("Invert Colors", value=True)
 
+st.session_state['rerun_count'] = st.session_state.get('rerun_count', 0) + 1
+with st.sidebar.expander("📊 Cache Stats"):
+    st.write({"reruns (this session)": st.session_state['rerun_count'],
+              "misses": CACHE_MISSES})
+
+@st.cache_resource(show_spinner=False)
+def get_session():
+    # Pooled keep-alive connection shared by all viewers: repeat fetches
+    # skip DNS + TCP + TLS setup entirely.
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'Mozilla/5.0'})
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return session
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_image_bytes(etag, last_modified):
+    # Conditional GET: if the camera frame hasn't changed upstream we get a
+    # 304 back and skip the ~100KB body transfer entirely.
+    CACHE_MISSES["fetch"] += 1
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = get_session().get(IMAGE_URL, headers=headers, timeout=5)
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return (response.content,
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'))
+
 def load_data():
     try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(IMAGE_URL, headers=headers, timeout=5)
-        response.raise_for_status()
-        img = Image.open(BytesIO(response.content))
-        return img
+        content, etag, last_modified = fetch_image_bytes(
+            st.session_state.get('img_etag'),
+            st.session_state.get('img_last_modified'))
+        if content is None:
+            # 304 Not Modified: reuse the bytes from the last full fetch
+            content = st.session_state['img_bytes']
+        else:
+            st.session_state['img_bytes'] = content
+            st.session_state['img_etag'] = etag
+            st.session_state['img_last_modified'] = last_modified
+        # No decode here: every consumer (process_image, closed_red_score)
+        # decodes from the bytes inside its own cache, keyed on this hash.
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
     except Exception as e:
         st.error(f"Error loading image: {e}")
         return None
 
-def process_image(img, thresh, crop_pct, resize, do_invert):
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def threshold_invert(arr, thr, invert):
+        # Fused threshold+invert: one pass over the upscaled frame instead
+        # of separate binarize and invert images.
+        out = np.empty_like(arr)
+        flat = arr.ravel()
+        out_flat = out.ravel()
+        for i in prange(flat.size):
+            hit = flat[i] > thr
+            if invert:
+                out_flat[i] = 0 if hit else 255
+            else:
+                out_flat[i] = 255 if hit else 0
+        return out
+else:
+    def threshold_invert(arr, thr, invert):
+        if invert:
+            return np.where(arr > thr, 0, 255).astype(np.uint8)
+        return np.where(arr > thr, 255, 0).astype(np.uint8)
+
+if HAVE_TESSEROCR:
+    @st.cache_resource(show_spinner=False)
+    def get_ocr_api(psm):
+        # One engine instance per PSM, loaded once per process and reused
+        # across reruns. The CLI wrapper forks a tesseract binary and
+        # reloads the language model on every single call.
+        # psm goes through as a plain int: tesserocr.PSM is a namespace of
+        # int constants, not a constructor (PSM(7) raises TypeError). The
+        # dawg switches are init-only parameters, so they must ride along
+        # in the constructor rather than SetVariable after Init.
+        api = tesserocr.PyTessBaseAPI(psm=psm, variables={
+            'load_system_dawg': '0', 'load_freq_dawg': '0'})
+        api.SetVariable('tessedit_char_whitelist', '$0123456789.CLOSED')
+        # process_image hands over a clean black-on-white binary image, so
+        # skip Leptonica's Otsu pass and the try-inverted heuristic.
+        api.SetVariable('thresholding_method', '0')
+        api.SetVariable('tessedit_do_invert', '0')
+        return api
+
+# Sized to cover the bands of every process_image entry (rows x 32) so a
+# long-lived server doesn't accrete one entry per camera frame forever.
+@st.cache_data(max_entries=64, show_spinner=False)
+def ocr_text(key, _img_bytes, psm):
+    # Tesseract is by far the most expensive step, so memoize its output.
+    # `key` is the content hash of the source frame (plus the preprocessing
+    # params); `_img_bytes` is underscore-prefixed so Streamlit doesn't hash
+    # the image bytes themselves on every lookup.
+    CACHE_MISSES["ocr"] += 1
+    if HAVE_TESSEROCR:
+        api = get_ocr_api(psm)
+        api.SetImage(Image.open(BytesIO(_img_bytes)))
+        return api.GetUTF8Text()
+    # Fallback: pipe the already-encoded image through tesseract's stdin
+    # rather than pytesseract's tempfile round-trip (PNG write, text-file
+    # read, unlink — per call).
+    cmd = ['tesseract', 'stdin', 'stdout', '--oem', '3', '--psm', str(psm),
+           '-c', 'tessedit_char_whitelist=$0123456789.CLOSED',
+           '-c', 'load_system_dawg=0', '-c', 'load_freq_dawg=0',
+           '-c', 'thresholding_method=0', '-c', 'tessedit_do_invert=0']
+    result = subprocess.run(cmd, input=_img_bytes, capture_output=True, check=True,
+                            env={**os.environ, 'OMP_THREAD_LIMIT': '1'})
+    return result.stdout.decode('utf-8')
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def closed_red_score(img_hash, _img_bytes):
+    # Cheap CLOSED heuristic: the closed-lane sign is lit almost entirely
+    # red. Decode a 1/8-scale color thumbnail (DCT-domain downscale, nearly
+    # free) and measure red dominance — no Tesseract involved.
+    img = Image.open(BytesIO(_img_bytes))
+    img.draft(None, (img.width // 8, img.height // 8))
+    arr = np.asarray(img.convert('RGB'), dtype=np.float32)
+    return float(arr[..., 0].mean() - arr[..., 1].mean())
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def process_image(img_hash, _img_bytes, thresh, crop_pct, resize, do_invert):
+    # Cached on (frame hash, params): dragging a slider back to a value
+    # already computed is a dict lookup, not a rerun of PIL + Tesseract.
+    CACHE_MISSES["process_image"] += 1
+    img = Image.open(BytesIO(_img_bytes))
+    # Hint libjpeg-turbo to decode straight to grayscale: the chroma planes
+    # are never touched and the later convert('L') short-circuits.
+    img.draft('L', img.size)
     w, h = img.size
     left = int(w * (crop_pct / 100))
     cropped = img.crop((left, 0, w, h))
-    gray = cropped.convert('L')
-    w_new, h_new = gray.size
-    resized = gray.resize((w_new * resize, h_new * resize), resample=Image.Resampling.BICUBIC)
-    binary = resized.point(lambda x: 255 if x > thresh else 0, '1')
-    
-    if do_invert:
-        final_img = ImageOps.invert(binary.convert('L'))
+    # draft('L') means JPEG frames are already single-channel here; only
+    # pay for a conversion if the camera ever serves a non-JPEG format.
+    gray = cropped if cropped.mode == 'L' else cropped.convert('L')
+    if resize > 1:
+        w_new, h_new = gray.size
+        # BILINEAR: the upscale feeds a hard threshold, so the extra BICUBIC
+        # taps buy nothing the binarization doesn't immediately throw away.
+        resized = gray.resize((w_new * resize, h_new * resize), resample=Image.Resampling.BILINEAR)
     else:
-        final_img = binary.convert('L')
+        resized = gray
+    arr = np.asarray(resized)
+    final_img = Image.fromarray(threshold_invert(arr, thresh, do_invert), 'L')
     
-    custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=$0123456789.'
-    text = pytesseract.image_to_string(final_img, config=custom_config)
-    
-    return text, final_img
+    # WebP for the browser-bound debug image: ~10x smaller than PNG for a
+    # binary frame, so less encode CPU and fewer bytes per websocket push.
+    buf = BytesIO()
+    final_img.save(buf, 'WEBP', quality=80)
+    webp_bytes = buf.getvalue()
+    key = f"{img_hash}:{thresh}:{crop_pct}:{resize}:{int(do_invert)}"
+
+    # The sign geometry is fixed — one price per row — so OCR each row band
+    # with psm 7 (single text line). That skips layout analysis entirely,
+    # and the texts come back one per band so the caller can pin each price
+    # to its SIGN_LOCATIONS slot even when some band reads empty.
+    rows = len(SIGN_LOCATIONS)
+    band_h = final_img.height // rows
+    band_bufs = []
+    for i in range(rows):
+        bottom = final_img.height if i == rows - 1 else (i + 1) * band_h
+        band = final_img.crop((0, i * band_h, final_img.width, bottom))
+        band_buf = BytesIO()
+        # BMP: uncompressed handoff, so neither side burns CPU on DEFLATE.
+        band.save(band_buf, 'BMP')
+        band_bufs.append(band_buf.getvalue())
+
+    if HAVE_TESSEROCR:
+        # The resident engine is a single shared instance and PyTessBaseAPI
+        # is not thread-safe, so bands run sequentially — cheap anyway with
+        # the model already loaded.
+        band_texts = [ocr_text(f"{key}:band{i}", b, 7) for i, b in enumerate(band_bufs)]
+    else:
+        # Subprocess invocations are independent, so the bands OCR in
+        # parallel; each child is pinned to one OpenMP thread so the
+        # instances don't oversubscribe the cores.
+        with ThreadPoolExecutor(max_workers=rows) as pool:
+            band_texts = list(pool.map(
+                lambda ib: ocr_text(f"{key}:band{ib[0]}", ib[1], 7),
+                enumerate(band_bufs)))
+    return band_texts, webp_bytes
 
 # --- Main Logic ---
 if st.button("🔄 Refresh Camera"):
     st.rerun()
 
-img = load_data()
+img_hash = load_data()
 
-if img:
+if img_hash:
     col1, col2 = st.columns([1, 1])
     
     with col1:
         st.subheader("💰 Live Rates")
+
+        # Early exit: when the sign is glowing red there are no prices to
+        # read, so skip the whole preprocess+OCR path. The OCR-text CLOSED
+        # check below stays as the backstop for marginal lighting.
+        if closed_red_score(img_hash, st.session_state['img_bytes']) > CLOSED_RED_THRESHOLD:
+            st.error("⛔ Southbound Toll Lanes are Closed")
+            st.stop()
+
         with st.spinner('Calculating...'):
-            full_text_check = pytesseract.image_to_string(img)
-            
-            if "CLOSED" in full_text_check.upper():
+            band_texts, processed_webp = process_image(img_hash, st.session_state['img_bytes'],
+                                                       threshold_val, crop_val, resize_factor, invert_img)
+            raw_text = "\n".join(band_texts)
+
+            if CLOSED_RE.search(raw_text):
                 st.error("⛔ Southbound Toll Lanes are Closed")
             else:
-                raw_text, processed_img = process_image(img, threshold_val, crop_val, resize_factor, invert_img)
-                
-                # Regex for prices
-                matches = re.findall(r'\$?\s?(\d*\.\d{2})', raw_text)
-                
-                data = []
-                avg_rate_per_mile = 0.10 # fallback default
-                
-                # 1. Process Visible Signs
-                for i, price_str in enumerate(matches):
-                    if i < len(SIGN_LOCATIONS):
-                        try:
-                            if price_str.startswith('.'): price_str = "0" + price_str
-                            val = float(price_str)
-                            if val > 20.0: continue 
-
-                            dest = SIGN_LOCATIONS[i]
-                            per_mile = val / dest['dist']
-                            
-                            # If this is the I-285 price (longest trip), use it as the "True Rate"
-                            if dest['name'] == "I-285":
-                                avg_rate_per_mile = per_mile
-
-                            data.append({
-                                "Destination": dest['name'],
-                                "Price": f"${val:.2f}",
-                                "$/Mile": f"${per_mile:.2f}"
-                            })
-                        except ValueError:
-                            continue
-                
+                # 1. Process Visible Signs. Scan each band's text on its
+                # own so a price keeps its sign-row slot even when another
+                # band OCRs empty, then parse column-wise: the zero prefix
+                # makes bare '.50' reads parse, to_numeric NaNs out garbage,
+                # and the phantom-leading-digit fixup ("$0.50" read as
+                # "80.50") is one arithmetic pass over the column.
+                slots, found = [], []
+                for i, band_text in enumerate(band_texts):
+                    band_prices = scan_prices(band_text)
+                    if band_prices:
+                        slots.append(i)
+                        found.append(band_prices[0])
+
+                s = pd.Series(found, dtype=object)
+                vals = pd.to_numeric('0' + s, errors='coerce')
+                vals = vals.where(vals <= 20.0, vals - 10 * (vals // 10))
+                keep = vals.notna() & (vals <= 20.0)
+                idxs = np.asarray(slots, dtype=int)[keep.to_numpy()]
+                prices = vals[keep].tolist()
+
                 # 2. Calculate Hidden Destination (Terrell Mill)
                 # Only add if we found at least one price to base the rate on
-                if data:
-                    terrell_price = avg_rate_per_mile * TERRELL_MILL_DIST
+                if prices:
+                    dests = [SIGN_NAMES[i] for i in idxs]
+                    price_arr = np.asarray(prices)
+                    per_mile_arr = price_arr / SIGN_DISTS[idxs]
+
+                    # If the I-285 price (longest trip) is visible, use it as the "True Rate"
+                    avg_rate_per_mile = 0.10 # fallback default
+                    if "I-285" in dests:
+                        avg_rate_per_mile = float(per_mile_arr[dests.index("I-285")])
+
                     # Insert it in the middle (Index 1)
-                    data.insert(1, {
-                        "Destination": "Terrell Mill (Calc)",
-                        "Price": f"${terrell_price:.2f}",
-                        "$/Mile": f"${avg_rate_per_mile:.2f}"
-                    })
+                    dests.insert(1, "Terrell Mill (Calc)")
+                    price_arr = np.insert(price_arr, 1, avg_rate_per_mile * TERRELL_MILL_DIST)
+                    per_mile_arr = np.insert(per_mile_arr, 1, avg_rate_per_mile)
 
-                    df = pd.DataFrame(data)
-                    st.dataframe(df, hide_index=True, use_container_width=True)
+                    df = pd.DataFrame({
+                        "Destination": dests,
+                        "Price": price_arr,
+                        "$/Mile": per_mile_arr
+                    })
+                    st.dataframe(df.style.format({"Price": "${:.2f}", "$/Mile": "${:.2f}"}),
+                                 hide_index=True, use_container_width=True)
                 else:
                     st.warning("No rates detected.")
 
     with col2:
         st.subheader("👁️ Debug View")
-        if 'processed_img' in locals():
-            st.image(processed_img, caption=f"Debug Feed", use_container_width=True)
+        if 'processed_webp' in locals():
+            st.image(processed_webp, caption=f"Debug Feed", use_container_width=True)
             st.code(raw_text)